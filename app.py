@@ -1,15 +1,29 @@
 import streamlit as st
-from PIL import Image
+from PIL import Image, ImageStat
 import google.generativeai as genai
-import json
-import re
-from typing import Dict, Optional
+from google.api_core import exceptions as google_exceptions
+import asyncio
+import datetime
+import diskcache
+import functools
+import hashlib
+import io
+import msgspec
+import numpy as np
+import orjson
+import threading
+from typing import Annotated, Dict, List, Optional
 import plotly.graph_objects as go
 import plotly.express as px
 
-# Configure Gemini API
-genai.configure(api_key=st.secrets["auth_key"])
-model = genai.GenerativeModel("models/gemini-2.5-pro")
+# Gemini API settings
+MODEL_NAME = "models/gemini-2.5-pro"
+RESPONSE_CACHE_DIR = ".solar_cache"
+RESPONSE_CACHE_TTL = datetime.timedelta(days=7)
+# gemini-2.5-pro is a thinking model and usually needs well over 10 s for this report,
+# so only hedge once a request is clearly stalled; an early hedge doubles Gemini spend
+HEDGE_DELAY_SECONDS = 60.0
+ANALYSIS_TIMEOUT_SECONDS = 180.0  # Upper bound on waiting for one (possibly hedged) attempt
 
 # Streamlit page config
 st.set_page_config(
@@ -29,6 +43,17 @@ PANEL_WATTAGE = 400  # Watts per panel
 PANEL_AREA = 2.0  # m² per panel
 COST_PER_KW = 45000  # INR per kW installed
 ELECTRICITY_RATE = 7.5  # INR per kWh
+SEASONAL_FACTORS = np.array([0.85, 0.90, 0.95, 1.0, 1.05, 1.1, 
+                             1.1, 1.05, 1.0, 0.95, 0.90, 0.85])  # Jan-Dec generation vs. average
+PROJECTION_YEARS = np.arange(1, 26)  # 25-year system lifetime
+IMAGE_MAX_SIZE = (768, 768)  # One Gemini vision tile
+IMAGE_WEBP_QUALITY = 80
+ROOFTOP_MAX_ASPECT_RATIO = 3.0  # Wider/taller images are panoramas or screenshots
+ROOFTOP_MIN_PIXEL_STDDEV = 5.0  # Below this the image is blank or a solid colour
+REPORT_CACHE_MAX_ENTRIES = 100  # Per-report memoized pie charts kept in memory
+REPORT_CACHE_TTL = datetime.timedelta(hours=1)
+IMAGE_CACHE_MAX_ENTRIES = 32  # Prepared WebP uploads kept in memory
+IMAGE_CACHE_TTL = datetime.timedelta(minutes=30)
 
 # Input method selection
 col1, col2 = st.columns([1, 3])
@@ -123,200 +148,369 @@ RETURN STRICT JSON FORMAT:
   }
 }
 
-For invalid images return: {"error": "Invalid rooftop image", "valid_data": false}
-Return ONLY the JSON, no explanations or markdown formatting.
+Set "valid_data" to true and "error" to null for a completed analysis.
+For invalid images set "valid_data" to false, "error" to "Invalid rooftop image" and every section to null.
 """
 
+# Per-request parts; base_prompt itself travels as the system instruction
+IMAGE_CONTEXT_TEMPLATE = "Additional context: Roof type is {roof_type}, Building type is {building_type}"
+LOCATION_PROMPT_TEMPLATE = """
+Analyze rooftop solar panel feasibility for:
+- Latitude: {lat}
+- Longitude: {lon}
+- Approximate roof area: {roof_area} m²
+- Building type: {building_type}
+- Number of floors: {floors}
+- Roof accessibility: {roof_access}
+"""
+
+# Response schema (mirrors the JSON contract in base_prompt)
+class LocationAnalysis(msgspec.Struct):
+    roof_orientation: str
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    climate_zone: Optional[str] = None
+    roof_tilt_degrees: Optional[float] = None
+    shading_factor: Optional[float] = None
+
+class TechnicalSpecifications(msgspec.Struct):
+    total_roof_area_m2: Annotated[float, msgspec.Meta(gt=0)]
+    usable_roof_area_m2: Annotated[float, msgspec.Meta(gt=0)]
+    average_daily_irradiance_kWh_per_m2: float
+    recommended_capacity_kW: Annotated[float, msgspec.Meta(gt=0, le=1000)]  # Max 1MW
+    panel_count: int
+    system_efficiency_percent: float
+    panel_type: Optional[str] = None
+    inverter_capacity_kW: Optional[float] = None
+    
+    def __post_init__(self):
+        if self.usable_roof_area_m2 > self.total_roof_area_m2:
+            raise ValueError("usable roof area exceeds total roof area")
+
+class EnergyProduction(msgspec.Struct):
+    estimated_daily_generation_kWh: float
+    estimated_monthly_generation_kWh: float
+    estimated_annual_generation_kWh: float
+    capacity_utilization_factor_percent: Optional[float] = None
+    performance_ratio: Optional[float] = None
+
+class FinancialAnalysis(msgspec.Struct):
+    total_installation_cost_INR: float
+    annual_electricity_savings_INR: float
+    payback_period_years: float
+    savings_25_year_INR: float = msgspec.field(name="25_year_savings_INR")
+    return_on_investment_percent: float
+
+class EnvironmentalImpact(msgspec.Struct):
+    annual_CO2_reduction_kg: float
+    CO2_reduction_25_year_tons: float = msgspec.field(name="25_year_CO2_reduction_tons")
+    equivalent_trees_planted: float
+
+class RegulatoryBenefits(msgspec.Struct):
+    subsidy_amount_INR: float
+    net_metering_available: bool
+    subsidy_percentage: Optional[float] = None
+    accelerated_depreciation_available: Optional[bool] = None
+
+class Recommendations(msgspec.Struct):
+    feasibility_score: Annotated[float, msgspec.Meta(ge=1, le=10)]
+    key_advantages: List[str]
+    potential_challenges: List[str]
+    implementation_timeline_months: float
+
+# Sections are nullable so an invalid-image answer can satisfy the schema;
+# validate_solar_data requires them whenever valid_data is true
+class SolarReport(msgspec.Struct):
+    location_analysis: Optional[LocationAnalysis] = None
+    technical_specifications: Optional[TechnicalSpecifications] = None
+    energy_production: Optional[EnergyProduction] = None
+    financial_analysis: Optional[FinancialAnalysis] = None
+    environmental_impact: Optional[EnvironmentalImpact] = None
+    regulatory_benefits: Optional[RegulatoryBenefits] = None
+    recommendations: Optional[Recommendations] = None
+    valid_data: bool = True
+    error: Optional[str] = None
+
+def gemini_schema(struct_type: type) -> Dict:
+    """Translate a Struct's JSON schema into the subset Gemini's response_schema accepts."""
+    (root,), components = msgspec.json.schema_components([struct_type])
+    
+    def convert(node: Dict) -> Dict:
+        if "$ref" in node:
+            node = components[node["$ref"].rsplit("/", 1)[-1]]
+        if "anyOf" in node:
+            # Optional[X] -> nullable X
+            (inner,) = [option for option in node["anyOf"] if option.get("type") != "null"]
+            return {**convert(inner), "nullable": True}
+        
+        schema = {"type": node["type"]}
+        if "enum" in node:
+            schema["enum"] = node["enum"]
+        if "items" in node:
+            schema["items"] = convert(node["items"])
+        if "properties" in node:
+            # Every key is emitted; optional ones are nullable instead of omitted
+            schema["properties"] = {name: convert(prop) for name, prop in node["properties"].items()}
+            schema["required"] = list(node["properties"])
+        return schema
+    
+    return convert(root)
+
+# Structured output: Gemini emits bare JSON that follows SolarReport
+GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": gemini_schema(SolarReport),
+    "temperature": 0.2
+}
+
+# Configure Gemini API once per server process, not on every rerun
+@st.cache_resource(show_spinner=False)
+def configure_gemini() -> None:
+    """Configure the Gemini client with the API key from Streamlit secrets."""
+    # Leave transport unset: clients then default to gRPC (sync) and grpc_asyncio (async),
+    # each keeping one HTTP/2 channel. Passing transport="grpc" would also be handed to
+    # the async client and break generate_content_async.
+    genai.configure(api_key=st.secrets["auth_key"])
+
+# base_prompt (~800 tokens) is below Gemini's minimum cacheable size, so it is not
+# uploaded as CachedContent; it travels as the model's system instruction instead.
+@st.cache_resource(show_spinner=False)
+def get_model() -> genai.GenerativeModel:
+    """Build the model once per server process, carrying base_prompt as its system instruction."""
+    configure_gemini()
+    return genai.GenerativeModel(
+        MODEL_NAME,
+        system_instruction=base_prompt,
+        generation_config=GENERATION_CONFIG
+    )
+
+model = get_model()
+
 # Validation functions
 def validate_coordinates(lat: float, lon: float) -> bool:
     """Validate latitude and longitude values."""
     return -90 <= lat <= 90 and -180 <= lon <= 180
 
 def validate_solar_data(data: Dict) -> bool:
-    """Validate parsed solar analysis data."""
+    """Validate parsed solar analysis data; sections are only required for a completed analysis."""
     try:
-        # Check required fields
-        required_sections = [
-            'location_analysis', 'technical_specifications', 
-            'energy_production', 'financial_analysis'
-        ]
-        for section in required_sections:
-            if section not in data:
-                return False
-        
-        # Validate ranges
-        tech = data['technical_specifications']
-        if not (0 < tech['usable_roof_area_m2'] <= tech['total_roof_area_m2']):
-            return False
-        if not (0 < tech['recommended_capacity_kW'] <= 1000):  # Max 1MW
-            return False
-        
+        report = msgspec.convert(data, SolarReport)
+    except msgspec.ValidationError:
+        return False
+    
+    if not report.valid_data:
         return True
-    except:
+    return all(
+        getattr(report, name) is not None
+        for name in report.__struct_fields__
+        if name not in ("valid_data", "error")
+    )
+
+# Image preprocessing
+def looks_like_rooftop(image: Image.Image) -> bool:
+    """Cheap local check that rejects obviously unusable uploads before calling Gemini."""
+    width, height = image.size
+    if max(width, height) > ROOFTOP_MAX_ASPECT_RATIO * min(width, height):
         return False
+    
+    stddev = ImageStat.Stat(image.convert("L")).stddev[0]
+    return stddev >= ROOFTOP_MIN_PIXEL_STDDEV
+
+@st.cache_data(max_entries=IMAGE_CACHE_MAX_ENTRIES, ttl=IMAGE_CACHE_TTL, show_spinner=False)
+def _prepare_image(raw_bytes: bytes) -> bytes:
+    """Decode an upload, shrink it to one vision tile and re-encode it as WebP."""
+    image = Image.open(io.BytesIO(raw_bytes))
+    image.thumbnail(IMAGE_MAX_SIZE, Image.Resampling.LANCZOS)
+    
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format="WEBP", quality=IMAGE_WEBP_QUALITY, method=6)
+    return buffer.getvalue()
+
+# Chart builders
+def _monthly_generation(monthly_kwh: float) -> list:
+    """Spread the monthly average over a seasonal generation curve."""
+    return (SEASONAL_FACTORS * monthly_kwh).tolist()
+
+def _build_monthly_fig(energy: Dict) -> go.Figure:
+    """Build the monthly energy generation bar chart."""
+    months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 
+              'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+    monthly_variation = _monthly_generation(energy['estimated_monthly_generation_kWh'])
+    
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        x=months,
+        y=monthly_variation,
+        text=[f'{val:.0f}' for val in monthly_variation],
+        textposition='auto',
+        marker_color='gold'
+    ))
+    fig.update_layout(
+        title="Estimated Monthly Energy Generation (kWh)",
+        xaxis_title="Month",
+        yaxis_title="Energy (kWh)",
+        height=400
+    )
+    return fig
 
-def clean_json_response(text: str) -> str:
-    """Clean and extract JSON from Gemini response."""
-    # Remove markdown code blocks
-    text = re.sub(r'```json\s*', '', text)
-    text = re.sub(r'```\s*', '', text)
+# Unpickling a cached go.Figure re-runs its validation, which costs more than
+# building the bar and scatter charts again; only px.pie is slow enough to memoize
+@st.cache_data(max_entries=REPORT_CACHE_MAX_ENTRIES, ttl=REPORT_CACHE_TTL, show_spinner=False)
+def _build_cost_pie(fin: Dict, reg: Dict) -> go.Figure:
+    """Build the installation cost breakdown pie chart."""
+    labels = ['Base Cost', 'Subsidy Benefit']
+    values = [
+        fin['total_installation_cost_INR'] - reg['subsidy_amount_INR'],
+        reg['subsidy_amount_INR']
+    ]
     
-    # Find JSON object
-    json_match = re.search(r'\{.*\}', text, re.DOTALL)
-    if json_match:
-        return json_match.group(0)
-    return text
+    fig = px.pie(
+        values=values, 
+        names=labels,
+        title="Installation Cost Breakdown",
+        hole=0.4
+    )
+    fig.update_traces(
+        text=[f'₹{v:,.0f}' for v in values],
+        textposition='inside',
+        textinfo='percent+text'
+    )
+    return fig
+
+def _build_co2_scatter(env: Dict) -> go.Figure:
+    """Build the cumulative 25-year CO₂ reduction chart."""
+    years = PROJECTION_YEARS.tolist()
+    cumulative_co2 = (PROJECTION_YEARS * env['annual_CO2_reduction_kg'] / 1000).tolist()
+    
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=years,
+        y=cumulative_co2,
+        mode='lines+markers',
+        fill='tozeroy',
+        line=dict(color='green', width=3),
+        marker=dict(size=6),
+        name='CO₂ Reduction'
+    ))
+    fig.update_layout(
+        title="Cumulative CO₂ Reduction Over 25 Years (Tons)",
+        xaxis_title="Years",
+        yaxis_title="CO₂ Reduction (Tons)",
+        height=400,
+        showlegend=False
+    )
+    return fig
+
+# Metric labels; formatting is cheaper than st.cache_data hashing the whole report
+def _format_report(data: Dict) -> Dict[str, str]:
+    """Preformat every metric value shown in the report."""
+    tech = data['technical_specifications']
+    loc = data['location_analysis']
+    energy = data['energy_production']
+    fin = data['financial_analysis']
+    reg = data['regulatory_benefits']
+    env = data['environmental_impact']
+    rec = data['recommendations']
+    
+    score = rec['feasibility_score']
+    net_cost = fin['total_installation_cost_INR'] - reg['subsidy_amount_INR']
+    return {
+        'score_color': "🟢" if score >= 7 else "🟡" if score >= 5 else "🔴",
+        'score': f"{score}/10",
+        'payback': format(fin['payback_period_years'], '.1f') + " years",
+        'roi': format(fin['return_on_investment_percent'], '.1f') + "%",
+        'usable_area': format(tech['usable_roof_area_m2'], '.1f') + " m²",
+        'capacity': format(tech['recommended_capacity_kW'], '.1f') + " kW",
+        'panel_count': str(tech['panel_count']),
+        'irradiance': format(tech['average_daily_irradiance_kWh_per_m2'], '.1f') + " kWh/m²",
+        'orientation': loc['roof_orientation'].title(),
+        'efficiency': format(tech['system_efficiency_percent'], '.1f') + "%",
+        'daily_generation': format(energy['estimated_daily_generation_kWh'], '.1f') + " kWh",
+        'monthly_generation': format(energy['estimated_monthly_generation_kWh'], ',.0f') + " kWh",
+        'annual_generation': format(energy['estimated_annual_generation_kWh'], ',.0f') + " kWh",
+        'total_cost': "₹" + format(fin['total_installation_cost_INR'], ',.0f'),
+        'subsidy': "₹" + format(reg['subsidy_amount_INR'], ',.0f'),
+        'net_cost': "₹" + format(net_cost, ',.0f'),
+        'annual_savings': "₹" + format(fin['annual_electricity_savings_INR'], ',.0f'),
+        'savings_25_year': "₹" + format(fin['25_year_savings_INR'], ',.0f'),
+        'net_metering': "✅ Available" if reg['net_metering_available'] else "❌ Not Available",
+        'annual_co2': format(env['annual_CO2_reduction_kg'], ',.0f') + " kg",
+        'co2_25_year': format(env['25_year_CO2_reduction_tons'], '.1f') + " tons",
+        'trees': format(env['equivalent_trees_planted'], ',.0f') + " trees",
+        'timeline': f"{rec['implementation_timeline_months']} months"
+    }
 
 # Enhanced visualizer with charts
 def visualize_detailed_report(data: Dict):
     """Create comprehensive visualization of solar analysis."""
+    fmt = _format_report(data)
     
     # Header metrics
     st.subheader("🎯 Feasibility Overview")
-    score = data['recommendations']['feasibility_score']
-    score_color = "🟢" if score >= 7 else "🟡" if score >= 5 else "🔴"
     
     col1, col2, col3, col4 = st.columns(4)
     col1.metric(
-        f"{score_color} Feasibility Score", 
-        f"{score}/10",
+        f"{fmt['score_color']} Feasibility Score", 
+        fmt['score'],
         help="Based on location, roof characteristics, and financial viability"
     )
-    col2.metric(
-        "💰 Payback Period", 
-        f"{data['financial_analysis']['payback_period_years']:.1f} years"
-    )
-    col3.metric(
-        "🌱 Annual CO₂ Reduction", 
-        f"{data['environmental_impact']['annual_CO2_reduction_kg']:,.0f} kg"
-    )
-    col4.metric(
-        "📊 ROI", 
-        f"{data['financial_analysis']['return_on_investment_percent']:.1f}%"
-    )
+    col2.metric("💰 Payback Period", fmt['payback'])
+    col3.metric("🌱 Annual CO₂ Reduction", fmt['annual_co2'])
+    col4.metric("📊 ROI", fmt['roi'])
     
     # Technical specifications
     with st.expander("⚙️ Technical Specifications", expanded=True):
-        tech = data['technical_specifications']
-        loc = data['location_analysis']
-        
         col1, col2, col3 = st.columns(3)
-        col1.metric("Usable Roof Area", f"{tech['usable_roof_area_m2']:.1f} m²")
-        col2.metric("System Capacity", f"{tech['recommended_capacity_kW']:.1f} kW")
-        col3.metric("Number of Panels", tech['panel_count'])
+        col1.metric("Usable Roof Area", fmt['usable_area'])
+        col2.metric("System Capacity", fmt['capacity'])
+        col3.metric("Number of Panels", fmt['panel_count'])
         
         col4, col5, col6 = st.columns(3)
-        col4.metric("Daily Irradiance", f"{tech['average_daily_irradiance_kWh_per_m2']:.1f} kWh/m²")
-        col5.metric("Roof Orientation", loc['roof_orientation'].title())
-        col6.metric("System Efficiency", f"{tech['system_efficiency_percent']:.1f}%")
+        col4.metric("Daily Irradiance", fmt['irradiance'])
+        col5.metric("Roof Orientation", fmt['orientation'])
+        col6.metric("System Efficiency", fmt['efficiency'])
     
     # Energy production chart
     with st.expander("⚡ Energy Production Analysis", expanded=True):
-        energy = data['energy_production']
-        
         # Monthly generation chart
-        months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 
-                  'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-        monthly_variation = [
-            energy['estimated_monthly_generation_kWh'] * factor 
-            for factor in [0.85, 0.90, 0.95, 1.0, 1.05, 1.1, 
-                          1.1, 1.05, 1.0, 0.95, 0.90, 0.85]
-        ]
-        
-        fig = go.Figure()
-        fig.add_trace(go.Bar(
-            x=months,
-            y=monthly_variation,
-            text=[f'{val:.0f}' for val in monthly_variation],
-            textposition='auto',
-            marker_color='gold'
-        ))
-        fig.update_layout(
-            title="Estimated Monthly Energy Generation (kWh)",
-            xaxis_title="Month",
-            yaxis_title="Energy (kWh)",
-            height=400
-        )
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(_build_monthly_fig(data['energy_production']), use_container_width=True)
         
         col1, col2, col3 = st.columns(3)
-        col1.metric("Daily Generation", f"{energy['estimated_daily_generation_kWh']:.1f} kWh")
-        col2.metric("Monthly Average", f"{energy['estimated_monthly_generation_kWh']:,.0f} kWh")
-        col3.metric("Annual Generation", f"{energy['estimated_annual_generation_kWh']:,.0f} kWh")
+        col1.metric("Daily Generation", fmt['daily_generation'])
+        col2.metric("Monthly Average", fmt['monthly_generation'])
+        col3.metric("Annual Generation", fmt['annual_generation'])
     
     # Financial analysis
     with st.expander("💰 Financial Analysis", expanded=True):
-        fin = data['financial_analysis']
-        reg = data['regulatory_benefits']
-        
         # Cost breakdown pie chart
-        labels = ['Base Cost', 'Subsidy Benefit']
-        values = [
-            fin['total_installation_cost_INR'] - reg['subsidy_amount_INR'],
-            reg['subsidy_amount_INR']
-        ]
-        
-        fig = px.pie(
-            values=values, 
-            names=labels,
-            title="Installation Cost Breakdown",
-            hole=0.4
-        )
-        fig.update_traces(
-            text=[f'₹{v:,.0f}' for v in values],
-                        textposition='inside',
-            textinfo='percent+text'
-        )
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(_build_cost_pie(data['financial_analysis'], data['regulatory_benefits']), use_container_width=True)
         
         col1, col2 = st.columns(2)
         with col1:
-            st.metric("Total Installation Cost", f"₹{fin['total_installation_cost_INR']:,.0f}")
-            st.metric("Subsidy Amount", f"₹{reg['subsidy_amount_INR']:,.0f}")
-            st.metric("Net Cost", f"₹{fin['total_installation_cost_INR'] - reg['subsidy_amount_INR']:,.0f}")
+            st.metric("Total Installation Cost", fmt['total_cost'])
+            st.metric("Subsidy Amount", fmt['subsidy'])
+            st.metric("Net Cost", fmt['net_cost'])
         
         with col2:
-            st.metric("Annual Savings", f"₹{fin['annual_electricity_savings_INR']:,.0f}")
-            st.metric("25-Year Savings", f"₹{fin['25_year_savings_INR']:,.0f}")
-            st.metric("Net Metering", "✅ Available" if reg['net_metering_available'] else "❌ Not Available")
+            st.metric("Annual Savings", fmt['annual_savings'])
+            st.metric("25-Year Savings", fmt['savings_25_year'])
+            st.metric("Net Metering", fmt['net_metering'])
     
     # Environmental impact
     with st.expander("🌍 Environmental Impact", expanded=True):
-        env = data['environmental_impact']
-        
         col1, col2, col3 = st.columns(3)
-        col1.metric("Annual CO₂ Reduction", f"{env['annual_CO2_reduction_kg']:,.0f} kg")
-        col2.metric("25-Year CO₂ Reduction", f"{env['25_year_CO2_reduction_tons']:.1f} tons")
-        col3.metric("Equivalent Trees", f"{env['equivalent_trees_planted']:,.0f} trees")
+        col1.metric("Annual CO₂ Reduction", fmt['annual_co2'])
+        col2.metric("25-Year CO₂ Reduction", fmt['co2_25_year'])
+        col3.metric("Equivalent Trees", fmt['trees'])
         
         # CO2 savings over time
-        years = list(range(1, 26))
-        cumulative_co2 = [env['annual_CO2_reduction_kg'] * year / 1000 for year in years]
-        
-        fig = go.Figure()
-        fig.add_trace(go.Scatter(
-            x=years,
-            y=cumulative_co2,
-            mode='lines+markers',
-            fill='tozeroy',
-            line=dict(color='green', width=3),
-            marker=dict(size=6),
-            name='CO₂ Reduction'
-        ))
-        fig.update_layout(
-            title="Cumulative CO₂ Reduction Over 25 Years (Tons)",
-            xaxis_title="Years",
-            yaxis_title="CO₂ Reduction (Tons)",
-            height=400,
-            showlegend=False
-        )
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(_build_co2_scatter(data['environmental_impact']), use_container_width=True)
     
     # Recommendations
     with st.expander("📋 Recommendations & Next Steps", expanded=True):
         rec = data['recommendations']
         
-        st.markdown(f"**Implementation Timeline:** {rec['implementation_timeline_months']} months")
+        st.markdown(f"**Implementation Timeline:** {fmt['timeline']}")
         
         col1, col2 = st.columns(2)
         with col1:
@@ -333,58 +527,165 @@ def visualize_detailed_report(data: Dict):
     st.markdown("---")
     st.caption("📌 **Note:** This is an AI-generated estimate based on satellite imagery, regional solar data, and standard industry assumptions. Actual results may vary. Please consult with a certified solar installer for precise calculations.")
 
+# Response cache for repeated analyses
+@st.cache_resource(show_spinner=False)
+def get_response_cache() -> diskcache.Cache:
+    """Open the on-disk store of previous analysis results."""
+    return diskcache.Cache(RESPONSE_CACHE_DIR)
+
+# Results produced by a different model, prompt, template or output schema must not be served
+PROMPT_FINGERPRINT = hashlib.sha256(
+    f"{MODEL_NAME}|{base_prompt}|{IMAGE_CONTEXT_TEMPLATE}|{LOCATION_PROMPT_TEMPLATE}|".encode()
+    + orjson.dumps(GENERATION_CONFIG, option=orjson.OPT_SORT_KEYS)
+).hexdigest()[:16]
+
+def image_cache_key(image_bytes: bytes, roof_type: str, building_type: str) -> str:
+    """Build the response cache key for an uploaded image."""
+    return f"image|{hashlib.sha256(image_bytes).hexdigest()}|{roof_type}|{building_type}"
+
+def coordinate_cache_key(lat: float, lon: float, roof_area: int, building_type: str,
+                         floors: int, roof_access: str) -> str:
+    """Build the response cache key for a location (~11 m coordinate precision)."""
+    return f"coords|{round(lat, 4)}|{round(lon, 4)}|{roof_area}|{building_type}|{floors}|{roof_access}"
+
+def cached_analysis(func):
+    """Serve repeated analyses from the response cache instead of calling Gemini again."""
+    @functools.wraps(func)
+    def wrapper(content, *args, cache_key: Optional[str] = None, **kwargs):
+        if cache_key is None:
+            return func(content, *args, **kwargs)
+        
+        cache = get_response_cache()
+        key = f"{PROMPT_FINGERPRINT}|{cache_key}"
+        result = cache.get(key)
+        if result is not None:
+            return result
+        
+        result = func(content, *args, **kwargs)
+        if result is not None:
+            cache.set(key, result, expire=RESPONSE_CACHE_TTL.total_seconds())
+        return result
+    return wrapper
+
+# Async Gemini requests
+@st.cache_resource(show_spinner=False)
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Run one long-lived event loop so the async gRPC channel outlives each rerun."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="gemini-event-loop", daemon=True).start()
+    return loop
+
+async def ping_model() -> None:
+    """Send a tiny request so channel setup and credential minting happen before the first analysis."""
+    try:
+        await model.count_tokens_async("ping")
+    except Exception:
+        # Warm-up is best effort; the first real request surfaces any error
+        pass
+
+@st.cache_resource(show_spinner=False)
+def warm_up_gemini() -> None:
+    """Start the warm-up once per server process without blocking the page."""
+    asyncio.run_coroutine_threadsafe(ping_model(), get_event_loop())
+
+warm_up_gemini()
+
+async def request_analysis(content) -> Dict:
+    """Send one analysis request and return the parsed, validated JSON."""
+    response = await model.generate_content_async(content)
+    
+    # Structured output is bare JSON, no fences or surrounding text to strip
+    parsed = orjson.loads(response.text)
+    
+    # Invalid-image answers pass validation too; they are a valid answer, not a failed attempt
+    if not validate_solar_data(parsed):
+        raise ValueError("Invalid data structure received")
+    return parsed
+
+async def hedged_analysis(content) -> Dict:
+    """Race a speculative second request against a stalled first one; the first usable answer wins."""
+    tasks = [asyncio.create_task(request_analysis(content))]
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=HEDGE_DELAY_SECONDS)
+        if not done:
+            tasks.append(asyncio.create_task(request_analysis(content)))
+            pending.add(tasks[-1])
+        
+        error = None
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            if not pending:
+                raise error
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        # asyncio.wait leaves its tasks running when this coroutine is cancelled,
+        # so stop the losing or abandoned requests explicitly
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
 # Error handling and retry mechanism
-def analyze_with_retry(content, max_retries=3):
-    """Analyze content with retry mechanism for better reliability."""
+@cached_analysis
+def analyze_with_retry(content, max_retries=2):
+    """Analyze content, retrying on Gemini server errors and unusable responses."""
+    # One status element, updated in place across attempts
+    status = st.status("🤖 Requesting analysis from Gemini...", expanded=False)
     for attempt in range(max_retries):
         try:
-            response = model.generate_content(content)
-            raw_text = response.text.strip()
-            
-            # Clean and parse JSON
-            json_text = clean_json_response(raw_text)
-            parsed = json.loads(json_text)
+            # Streamlit calls stay on the script thread; only the requests run on the loop
+            future = asyncio.run_coroutine_threadsafe(hedged_analysis(content), get_event_loop())
+            try:
+                parsed = future.result(timeout=ANALYSIS_TIMEOUT_SECONDS)
+            except TimeoutError:
+                # Cancels hedged_analysis on the loop; its finally cancels both in-flight requests
+                future.cancel()
+                raise
             
             # Check for error response
             if isinstance(parsed, dict) and parsed.get("valid_data") is False:
+                status.update(label="⚠️ Invalid rooftop image", state="error")
                 st.error("⚠️ The uploaded image does not contain a valid rooftop. Please upload a clear aerial/top view of a building.")
                 return None
             
-            # Validate data structure
-            if validate_solar_data(parsed):
-                return parsed
-            else:
-                if attempt < max_retries - 1:
-                    st.warning(f"Attempt {attempt + 1} failed. Retrying...")
-                    continue
-                else:
-                    raise ValueError("Invalid data structure received")
+            status.update(label="✅ Analysis complete", state="complete")
+            return parsed
                     
-        except json.JSONDecodeError as e:
+        # The schema constrains shape, not values, and temperature 0.2 still samples,
+        # so a malformed or out-of-range report can succeed on another attempt.
+        # Each retry is a full extra gemini-2.5-pro call, hence the small max_retries.
+        except (google_exceptions.ServerError, ValueError) as e:
             if attempt < max_retries - 1:
-                st.warning(f"JSON parsing error on attempt {attempt + 1}. Retrying...")
+                reason = "server error" if isinstance(e, google_exceptions.ServerError) else "unusable response"
+                status.update(label=f"Gemini {reason} on attempt {attempt + 1}. Retrying ({attempt + 2}/{max_retries})...")
                 continue
-            else:
-                st.error(f"Failed to parse response after {max_retries} attempts")
-                with st.expander("🔍 Debug Information"):
+            
+            if isinstance(e, orjson.JSONDecodeError):
+                status.update(label="❌ Failed to parse response", state="error", expanded=True)
+                with status:
                     st.text("Raw response:")
-                    st.code(raw_text if 'raw_text' in locals() else "No response received")
-                return None
+                    st.code(e.doc or "No response received")
+            else:
+                status.update(label=f"❌ Analysis failed: {str(e)}", state="error")
+            return None
+                
+        except TimeoutError:
+            status.update(label=f"❌ Gemini did not respond within {ANALYSIS_TIMEOUT_SECONDS:.0f} seconds", state="error")
+            return None
                 
         except Exception as e:
-            if attempt < max_retries - 1:
-                continue
-            else:
-                st.error(f"Analysis failed: {str(e)}")
-                return None
+            status.update(label=f"❌ Analysis failed: {str(e)}", state="error")
+            return None
     
     return None
 
 # Main analysis function
-def perform_analysis(content):
+def perform_analysis(content, cache_key: Optional[str] = None):
     """Main function to perform solar analysis."""
     with st.spinner("🔍 Analyzing solar potential... This may take a moment."):
-        result = analyze_with_retry(content)
+        result = analyze_with_retry(content, cache_key=cache_key)
         if result:
             visualize_detailed_report(result)
             
@@ -393,7 +694,7 @@ def perform_analysis(content):
             col1, col2, col3 = st.columns([1, 2, 1])
             with col2:
                 if st.button("📥 Download Detailed Report", type="primary", use_container_width=True):
-                    report_json = json.dumps(result, indent=2)
+                    report_json = orjson.dumps(result, option=orjson.OPT_INDENT_2)
                     st.download_button(
                         label="Download JSON Report",
                         data=report_json,
@@ -413,12 +714,10 @@ if option == "📷 Upload Image":
         )
         
         if uploaded_image:
-            # Display image with size limit
-            image = Image.open(uploaded_image)
-            
-            # Resize if too large
-            max_size = (1024, 1024)
-            image.thumbnail(max_size, Image.Resampling.LANCZOS)
+            # Resize and re-encode once per upload; reruns reuse the cached result
+            raw_bytes = uploaded_image.getvalue()
+            webp_bytes = _prepare_image(raw_bytes)
+            image = Image.open(io.BytesIO(webp_bytes))
             
             col1, col2, col3 = st.columns([1, 2, 1])
             with col2:
@@ -440,9 +739,13 @@ if option == "📷 Upload Image":
                         help="This affects subsidy calculations"
                     )
             
-            if st.button("🚀 Analyze Solar Potential", type="primary", use_container_width=True):
-                enhanced_prompt = f"{base_prompt}\n\nAdditional context: Roof type is {roof_type}, Building type is {building_type}"
-                perform_analysis([enhanced_prompt, image])
+            if not looks_like_rooftop(image):
+                st.error("⚠️ This image looks blank or is not an aerial view. Please upload a clear top-down image of the rooftop.")
+            elif st.button("🚀 Analyze Solar Potential", type="primary", use_container_width=True):
+                image_context = IMAGE_CONTEXT_TEMPLATE.format(roof_type=roof_type, building_type=building_type)
+                image_part = {"mime_type": "image/webp", "data": webp_bytes}
+                cache_key = image_cache_key(raw_bytes, roof_type, building_type)
+                perform_analysis([image_context, image_part], cache_key=cache_key)
 
 # Coordinate input interface
 elif option == "📍 Coordinates":
@@ -498,21 +801,16 @@ elif option == "📍 Coordinates":
                 )
         
         if st.button("📡 Analyze Location", type="primary", use_container_width=True):
-            if validate_coordinates(lat, lon):
-                location_prompt = f"""
-Analyze rooftop solar panel feasibility for:
-- Latitude: {lat}
-- Longitude: {lon}
-- Approximate roof area: {roof_area} m²
-- Building type: {building_type}
-- Number of floors: {floors}
-- Roof accessibility: {roof_access}
-
-{base_prompt}
-"""
-                perform_analysis(location_prompt)
-            else:
+            # Validate before any prompt or cache key is built
+            if not validate_coordinates(lat, lon):
                 st.error("❌ Invalid coordinates. Please check your input.")
+            else:
+                cache_key = coordinate_cache_key(lat, lon, roof_area, building_type, floors, roof_access)
+                location_prompt = LOCATION_PROMPT_TEMPLATE.format(
+                    lat=lat, lon=lon, roof_area=roof_area, building_type=building_type,
+                    floors=floors, roof_access=roof_access
+                )
+                perform_analysis([location_prompt], cache_key=cache_key)
 
 # Sidebar with additional information
 with st.sidebar: